@@ -5,7 +5,7 @@
     :license: MIT
 """
 from decimal import Decimal
-import re
+from functools import lru_cache
 import unittest
 
 CHEMICAL_SYMBOLS = (
@@ -22,11 +22,18 @@ CHEMICAL_SYMBOLS = (
     'Md', 'No', 'Lr', 'Rf', 'Db', 'Sg', 'Bh', 'Hs', 'Mt', 'Ds',
     'Rg', 'Cn', 'Nh', 'Fl', 'Mc', 'Lv', 'Ts', 'Og',
 )
-CHEMICAL_SYMBOL_PATTERN = f"({'|'.join(sorted(CHEMICAL_SYMBOLS, reverse=True))})"
+CHEMICAL_SYMBOL_PATTERN = r'[A-Z][a-z]?'  # a candidate; check the match against CHEMICAL_SYMBOLS
 POSITIVE_FLOAT_PATTERN = r'[0-9]+(\.[0-9]+)?'
 
-_prog_chemical_symbol = re.compile(CHEMICAL_SYMBOL_PATTERN)
-_prog_positive_float = re.compile(POSITIVE_FLOAT_PATTERN)
+_SYMBOL_SET = frozenset(CHEMICAL_SYMBOLS)
+_FORMULA_FIRST_CHARACTERS = frozenset(chemical_symbol[0] for chemical_symbol in CHEMICAL_SYMBOLS) | {'('}
+_DIGITS = frozenset('0123456789')
+
+# atomic ratios are computed as integers scaled by `_SCALE`, i.e., in fixed point with `_SCALE_DIGITS` decimal places
+_SCALE_DIGITS = 9
+_SCALE = 10 ** _SCALE_DIGITS
+
+_SMALL_INTEGER_DECIMALS = tuple(Decimal(i) for i in range(17))  # most atomic ratios are small integers
 
 
 class InvalidChemicalFormulaError(Exception):
@@ -43,6 +50,8 @@ def parse_atomic_ratio(string):
     :return: A dictionary whose key is chemical symbol and the value is the corresponding atomic ratio
     :rtype: dict
 
+    *Note* Atomic ratios are computed with nine decimal places; further digits are truncated.
+
     Examples:
         >>> from atomic_ratio_parser import parse_atomic_ratio
         >>> ratio_dict = parse_atomic_ratio('Chemical formula for aluminium sulfate is Al2(SO4)3')
@@ -50,139 +59,145 @@ def parse_atomic_ratio(string):
         >>> ratio_dict = parse_atomic_ratio('Pb0.95Na0.04Te, Bi2Te3')  # process only the first formula
         >>> assert(ratio_dict == {'Pb': Decimal('0.95'), 'Na': Decimal('0.04'), 'Te': Decimal('1')})
     """
+    return dict(_parse_atomic_ratio_items(string))
+
+
+@lru_cache(maxsize=4096)
+def _parse_atomic_ratio_items(string):
+    """Return the atomic ratios parsed from the string as a tuple of (chemical symbol, atomic ratio) pairs.
+    The result is cached, so it is immutable; :py:func:`parse_atomic_ratio` builds a new dictionary from it.
+
+    :param string: A string containing a chemical formula
+    :type string: str
+    :return: A tuple of chemical symbol-atomic ratio pairs
+    :rtype: tuple
+    """
     # remove non-necessary characters
     string = string.replace('_', '')
     string = string.replace('{', '')
     string = string.replace('}', '')
     string = string.replace(',', ' ')
 
-    result = {}
+    result = ()
     for token in string.split():
+        if token[0] not in _FORMULA_FIRST_CHARACTERS:  # not a chemical formula
+            continue
         try:
-            # expand the formula and parse it
-            expanded_formula = _get_expanded_chemical_formula(token)
-            result = _parse_atomic_ratio_from_expanded_chemical_formula(expanded_formula)
+            scaled_ratio_dict = _parse_atomic_ratio_from_chemical_formula(token)
         except InvalidChemicalFormulaError:  # not a chemical formula
             continue
+        result = tuple((chemical_symbol, _convert_scaled_int_to_decimal(scaled_ratio))
+                       for (chemical_symbol, scaled_ratio) in scaled_ratio_dict.items())
         break  # stop if a chemical formula is found
     return result
 
 
-def _get_expanded_chemical_formula(chemical_formula):
-    """Return an expanded chemical formula that has no parentheses.
-
-    *Warning* The result can have the same chemical symbol several times.
-
-    :param chemical_formula: A chemical formula that has no non-necessary symbols like `_`, `{`, `}`.
-    :type chemical_formula: str
-    :return: An expanded chemical formula
-    :rtype: str
+def _convert_scaled_int_to_decimal(scaled_int):
+    """Convert an integer scaled by `_SCALE` into a decimal without trailing zeros.
 
-    :raises InvalidChemicalFormulaError: When the `chemical_formula` is not a valid chemical formula.
+    :param scaled_int: A nonnegative integer scaled by `_SCALE`
+    :type scaled_int: int
+    :return: The decimal
+    :rtype: Decimal
     """
-    prev_formula = None
-    formula = chemical_formula
-
-    while formula != prev_formula:  # make the chemical formula as simple as possible
-        prev_formula = formula
-        formula = _expand_innermost_atomic_ratio(formula)
+    integer_part, fractional_part = divmod(scaled_int, _SCALE)
+    if fractional_part == 0:
+        if integer_part < len(_SMALL_INTEGER_DECIMALS):
+            return _SMALL_INTEGER_DECIMALS[integer_part]
+        return Decimal(integer_part)
+    return Decimal(f'{integer_part}.{fractional_part:0{_SCALE_DIGITS}d}'.rstrip('0'))
 
-    return formula
 
+def _scan_atomic_ratio(string, start_idx):
+    """Scan the positive float beginning at `start_idx` of the string as an atomic ratio.
+    The accepted floats are the ones matched by :py:data:`POSITIVE_FLOAT_PATTERN`.
+    If there is no positive float at `start_idx`, the atomic ratio is one.
 
-def _expand_innermost_atomic_ratio(chemical_formula):
-    """Remove the first, innermost parentheses of the chemical formula.
+    :param string: A string to scan
+    :type string: str
+    :param start_idx: The index to start scanning
+    :type start_idx: int
+    :return: The index just after the positive float, and the atomic ratio scaled by `_SCALE`.
+        Decimal places beyond `_SCALE_DIGITS` are truncated.
+    :rtype: tuple
+    """
+    length = len(string)
+    idx = start_idx
+    while idx < length and string[idx] in _DIGITS:
+        idx += 1
+    if idx == start_idx:  # atomic ratio is not stated
+        return start_idx, _SCALE
+    scaled_ratio = int(string[start_idx:idx]) * _SCALE
+
+    # the fractional part is valid only when it has a digit
+    if idx + 1 < length and string[idx] == '.' and string[idx+1] in _DIGITS:
+        fractional_idx = idx + 1
+        idx += 2
+        while idx < length and string[idx] in _DIGITS:
+            idx += 1
+        fractional_part = string[fractional_idx:min(idx, fractional_idx+_SCALE_DIGITS)]
+        scaled_ratio += int(fractional_part) * 10 ** (_SCALE_DIGITS - len(fractional_part))
+    return idx, scaled_ratio
+
+
+def _parse_atomic_ratio_from_chemical_formula(chemical_formula):
+    """Return a dictionary whose key is an atomic symbol and the value is the corresponding atomic ratio.
+    The formula is scanned once from left to right, keeping the atomic ratios inside each pair of
+    parentheses in a stack until the closing parenthesis and its ratio are found.
 
     :param chemical_formula: A chemical formula that has no non-necessary symbols like `_`, `{`, `}`.
     :type chemical_formula: str
-    :return: The chemical formula with the innermost formula expanded.
-    :rtype: str
+    :return: A dictionary of atomic symbol-atomic ratio pairs. The atomic ratios are integers scaled by `_SCALE`.
+    :rtype: dict
 
     :raises InvalidChemicalFormulaError: When the `chemical_formula` is not a valid chemical formula.
     """
-    # find the innermost parentheses
-    right_parenthesis_idx = chemical_formula.find(')')
-    left_parenthesis_idx = chemical_formula.rfind('(', 0, right_parenthesis_idx)
-    if right_parenthesis_idx < 0:
-        if left_parenthesis_idx < 0:  # if there is no parentheses, nothing to do
-            return chemical_formula
-        else:
-            raise InvalidChemicalFormulaError('Right parenthesis is missing')
-    if left_parenthesis_idx < 0:
-        raise InvalidChemicalFormulaError('Left parenthesis is missing')
-
-    ratio_match = _prog_positive_float.match(chemical_formula[right_parenthesis_idx+1:])
-    parentheses_ratio = Decimal('1')
-    if ratio_match:
-        parentheses_ratio = Decimal(ratio_match.group())
-
-    ratio_dict = _parse_atomic_ratio_from_expanded_chemical_formula(
-        chemical_formula[left_parenthesis_idx+1:right_parenthesis_idx])
-    for chemical_symbol in ratio_dict.keys():
-        ratio_dict[chemical_symbol] *= parentheses_ratio
-
-    expanded_str = _convert_ratio_dict_to_str(ratio_dict)
-
-    return chemical_formula[:left_parenthesis_idx] + expanded_str \
-        + chemical_formula[right_parenthesis_idx+len(ratio_match.group())+1:]
-
-
-def _convert_ratio_dict_to_str(ratio_dict):
-    """Convert a dictionary of atomic ratios into a string.
-    Chemical symbols are sorted by atomic number, and invalid chemical symbols are ignored.
-
-    :param ratio_dict: A dictionary of atomic ratios
-    :type ratio_dict: dict
-    :return: A chemical formula
-    :rtype: str
-    """
-    result = ''
-    for chemical_symbol in CHEMICAL_SYMBOLS:
-        atomic_ratio = ratio_dict.get(chemical_symbol)
-        if atomic_ratio:
-            result += chemical_symbol + str(atomic_ratio)
-
-    return result
-
-
-def _parse_atomic_ratio_from_expanded_chemical_formula(expanded_chemical_formula):
-    """Return a dictionary whose key is an atomic symbol and the value is the corresponding atomic ratio.
-    The input must be a simple, expanded chemical formula that has no parentheses and no non-necessary symbols like `_`.
-    For example, `Bi2Te3` is a simple, expanded chemical formula but `(BiTe)2Te` and `Bi_2Te_3` are not.
-
-    :param expanded_chemical_formula: A chemical formula that has no parentheses and no non-necessary symbols.
-    :type expanded_chemical_formula: str
-    :return: A dictionary of atomic symbol-atomic ratio pairs.
-    :rtype: dict
+    formula = chemical_formula
+    length = len(formula)
+    ratio_dict_stack = [{}]  # the last one is for the innermost parentheses
+
+    idx = 0
+    while idx < length:
+        if formula[idx] == '(':
+            ratio_dict_stack.append({})
+            idx += 1
+            continue
 
-    :raises InvalidChemicalFormulaError: When the `simple_chemical_formula` is not a simple, expanded chemical formula.
-    """
-    formula = expanded_chemical_formula
-    result = {}
+        if formula[idx] == ')':
+            if len(ratio_dict_stack) == 1:
+                raise InvalidChemicalFormulaError('Left parenthesis is missing')
+            idx += 1
+
+            # find the ratio of the parentheses
+            idx, parentheses_ratio = _scan_atomic_ratio(formula, idx)
+
+            # merge the atomic ratios into the outer parentheses
+            ratio_dict = ratio_dict_stack.pop()
+            outer_ratio_dict = ratio_dict_stack[-1]
+            for (chemical_symbol, atomic_ratio) in ratio_dict.items():
+                atomic_ratio = atomic_ratio * parentheses_ratio // _SCALE
+                if atomic_ratio:
+                    outer_ratio_dict[chemical_symbol] = outer_ratio_dict.get(chemical_symbol, 0) + atomic_ratio
+            continue
 
-    while len(formula) > 0:
-        # find chemical symbol
-        match = _prog_chemical_symbol.match(formula)
-        if not match:  # chemical symbol is not found
-            break
-        chemical_symbol = match.group()
-        formula = formula[len(chemical_symbol):]
+        # find chemical symbol; try two-letter symbol first
+        chemical_symbol = formula[idx:idx+2]
+        if chemical_symbol not in _SYMBOL_SET:
+            chemical_symbol = formula[idx]
+            if chemical_symbol not in _SYMBOL_SET:  # chemical symbol is not found
+                raise InvalidChemicalFormulaError(f'{repr(chemical_formula)} is not a valid chemical formula')
+        idx += len(chemical_symbol)
 
         # find atomic ratio
-        match = _prog_positive_float.match(formula)
-        atomic_ratio = Decimal('1')
-        if match:  # atomic ratio is stated
-            atomic_ratio_str = match.group()
-            atomic_ratio = Decimal(atomic_ratio_str)
-            formula = formula[len(atomic_ratio_str):]
+        idx, atomic_ratio = _scan_atomic_ratio(formula, idx)
 
-        result[chemical_symbol] = result.get(chemical_symbol, Decimal('0')) + atomic_ratio
+        ratio_dict = ratio_dict_stack[-1]
+        ratio_dict[chemical_symbol] = ratio_dict.get(chemical_symbol, 0) + atomic_ratio
 
-    if len(formula) > 0:
-        raise InvalidChemicalFormulaError(
-            f'{repr(expanded_chemical_formula)} is not a simple, expanded chemical formula')
+    if len(ratio_dict_stack) > 1:
+        raise InvalidChemicalFormulaError('Right parenthesis is missing')
 
-    return result
+    return ratio_dict_stack[0]
 
 
 class AtomicRatioParserTest(unittest.TestCase):
@@ -201,54 +216,52 @@ class AtomicRatioParserTest(unittest.TestCase):
             ('Chemical formula for aluminium sulfate is Al2(SO4)3',
              {'Al': Decimal('2'), 'S': Decimal('3'), 'O': Decimal('12')}),
             ('Pb0.95Na0.04Te, Bi2Te3', {'Pb': Decimal('0.95'), 'Na': Decimal('0.04'), 'Te': Decimal('1')}),
+            ('Quartz is SiO2', {'Si': Decimal('1'), 'O': Decimal('2')}),
         )
         for (input, output) in input_and_output_pairs:
             self.assertEqual(parse_atomic_ratio(input), output)
 
-    def test_get_expanded_chemical_formula(self):
-        input_and_output_pairs = (
-            ('(PbTe)0.7(PbS)0.3', 'Te0.7Pb0.7S0.3Pb0.3'),
-            ('(TePb(PbS)0.3)0.1(BiTe)2', 'S0.03Te0.1Pb0.13Te2Bi2'),
-        )
-        for (input, output) in input_and_output_pairs:
-            self.assertEqual(_get_expanded_chemical_formula(input), output)
-
-        inputs_raising_error = ('BiTe)2Te', 'Al2(SO4_3', '(Ale)2')
-        for input in inputs_raising_error:
-            with self.assertRaises(InvalidChemicalFormulaError):
-                _expand_innermost_atomic_ratio(input)
+        # modifying a result must not affect the cached one
+        parse_atomic_ratio('Bi2Te3')['Bi'] = Decimal('3')
+        self.assertEqual(parse_atomic_ratio('Bi2Te3'), {'Bi': Decimal('2'), 'Te': Decimal('3')})
 
-    def test_expand_innermost_atomic_ratio(self):
-        input_and_output_pairs = (
-            ('(PbTe)0.7(PbS)0.3', 'Te0.7Pb0.7(PbS)0.3'),
-            ('Bi2Te3(Pb)0.3', 'Bi2Te3Pb0.3'),
-            ('(TePb(PbS)0.3)0.1(BiTe)2', '(TePbS0.3Pb0.3)0.1(BiTe)2'),
+    def test_parse_atomic_ratio_from_chemical_formula(self):
+        formula_ratios_pairs = (
+            ('Bi2Te3', {'Bi': 2_000_000_000, 'Te': 3_000_000_000}),
+            ('PbTe0.7S0.3', {'Pb': 1_000_000_000, 'Te': 700_000_000, 'S': 300_000_000}),
+            ('(PbTe)0.7(PbS)0.3', {'Pb': 1_000_000_000, 'Te': 700_000_000, 'S': 300_000_000}),
+            ('(TePb(PbS)0.3)0.1(BiTe)2',
+             {'Te': 2_100_000_000, 'Pb': 130_000_000, 'S': 30_000_000, 'Bi': 2_000_000_000}),
+            ('(PbTe)Te', {'Pb': 1_000_000_000, 'Te': 2_000_000_000}),
         )
-        for (input, output) in input_and_output_pairs:
-            self.assertEqual(_expand_innermost_atomic_ratio(input), output)
+        for (formula, ratios) in formula_ratios_pairs:
+            self.assertEqual(_parse_atomic_ratio_from_chemical_formula(formula), ratios)
 
-        inputs_raising_error = ('BiTe)2Te', 'Al2(SO4_3', '(Ale)2')
-        for input in inputs_raising_error:
+        formulas_raising_error = ('BiTe)2Te', 'Al2(SO4_3', '(Ale)2', 'Bi_2Te_3', 'Al2(SO4)3.')
+        for formula in formulas_raising_error:
             with self.assertRaises(InvalidChemicalFormulaError):
-                _expand_innermost_atomic_ratio(input)
+                _parse_atomic_ratio_from_chemical_formula(formula)
 
-    def test_convert_ratio_dict_to_str(self):
+    def test_convert_scaled_int_to_decimal(self):
         input_and_output_pairs = (
-            ({'Bi': Decimal('2'), 'Te': Decimal('3')}, 'Te3Bi2'),
-            ({'Pb': Decimal('1'), 'Te': Decimal('0.7'), 'S': Decimal('0.3')}, 'S0.3Te0.7Pb1'),
+            (2_000_000_000, '2'),
+            (20_000_000_000, '20'),
+            (950_000_000, '0.95'),
+            (12_000_000_001, '12.000000001'),
+            (30_000_000, '0.03'),
         )
         for (input, output) in input_and_output_pairs:
-            self.assertEqual(_convert_ratio_dict_to_str(input), output)
-
-    def test_parse_atomic_ratio_from_expanded_chemical_formula(self):
-        formula_ratios_pairs = (
-            ('Bi2Te3', {'Bi': Decimal('2'), 'Te': Decimal('3')}),
-            ('PbTe0.7S0.3', {'Pb': Decimal('1'), 'Te': Decimal('0.7'), 'S': Decimal('0.3')}),
+            self.assertEqual(str(_convert_scaled_int_to_decimal(input)), output)
+
+    def test_scan_atomic_ratio(self):
+        string_idx_output_triples = (
+            ('Bi2Te3', 2, (3, 2_000_000_000)),
+            ('Pb0.95Na0.04Te', 2, (6, 950_000_000)),
+            ('Te12.000000001', 2, (14, 12_000_000_001)),
+            ('Te0.0000000001', 2, (14, 0)),
+            ('Te12.', 2, (4, 12_000_000_000)),
+            ('Te.5', 2, (2, 1_000_000_000)),
+            ('Te', 2, (2, 1_000_000_000)),
         )
-        for (formula, ratios) in formula_ratios_pairs:
-            self.assertEqual(_parse_atomic_ratio_from_expanded_chemical_formula(formula), ratios)
-
-        formulas_raising_error = ('(BiTe)2Te', 'Bi_2Te_3', 'Al_2(SO_4)_3')
-        for formula in formulas_raising_error:
-            with self.assertRaises(InvalidChemicalFormulaError):
-                _parse_atomic_ratio_from_expanded_chemical_formula(formula)
+        for (string, idx, output) in string_idx_output_triples:
+            self.assertEqual(_scan_atomic_ratio(string, idx), output)